@@ -1,9 +1,68 @@
+import array as _array
 import json
-import os
+import math
 import sqlite3
-import struct
-from collections import namedtuple
-from typing import List
+import sys
+from collections import namedtuple, OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+
+def _has_non_finite(obj) -> bool:
+    if isinstance(obj, float):
+        return not math.isfinite(obj)
+    if isinstance(obj, dict):
+        return any(_has_non_finite(v) for v in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return any(_has_non_finite(v) for v in obj)
+    if np is not None and isinstance(obj, (np.ndarray, np.floating)):
+        return obj.dtype.kind == "f" and not np.isfinite(obj).all()
+    return False
+
+
+if orjson is not None:
+    def _json_loads(data):
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # NaN/Infinity written by the stdlib json module
+            return json.loads(data)
+
+    def _json_dumps_bytes(obj) -> bytes:
+        try:
+            data = orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+        except TypeError:
+            # Types orjson does not support (ex. integers wider than 64 bits)
+            return json.dumps(obj).encode()
+
+        # orjson silently writes NaN/Infinity as null, only look for them when there is a null
+        if b"null" in data and _has_non_finite(obj):
+            return json.dumps(obj).encode()
+        return data
+
+    def _json_dumps(obj) -> str:
+        # SQLite binds bytes as BLOB, json_data must stay TEXT
+        return _json_dumps_bytes(obj).decode()
+else:
+    _json_loads = json.loads
+    _json_dumps = json.dumps
+
+    def _json_dumps_bytes(obj) -> bytes:
+        return json.dumps(obj).encode()
 
 _Sist2Version = namedtuple("Sist2Version", (
     "id", "date"
@@ -27,31 +86,170 @@ class Sist2Descriptor(_Sist2Descriptor):
     """
 
 
-_Sist2Document = namedtuple("Sist2Document", (
-    "id", "version", "mtime", "size", "json_data", "rel_path", "path", "mime", "parent"
-))
-
-
-class Sist2Document(_Sist2Document):
+@dataclass(slots=True, init=False, eq=False)
+class Sist2Document:
     """
     Sist2 document - instantiated by sist2.Sist2Index.document_iter
     """
 
+    id: str
+    version: int
+    mtime: int
+    size: int
+    mime: str | None
+    parent: str | None
+    # Lazily parsed/computed, see the properties below
+    _root_prefix: str = field(repr=False)
+    _json_raw: str | None = field(repr=False)
+    _json_data: dict | None = field(repr=False)
+    _rel_path: str | None = field(repr=False)
+    _path: str | None = field(repr=False)
+
+    def __init__(self, id: str, version: int, mtime: int, size: int, json_data: dict | str, mime: str | None,
+                 parent: str | None, root_prefix: str):
+        """
+        :param json_data: Document JSON, either as a dict or serialized (parsed on first access)
+        :param root_prefix: Index root, ending with a '/' (empty if the root is empty)
+        """
+        self.id = id
+        self.version = version
+        self.mtime = mtime
+        self.size = size
+        if isinstance(json_data, dict):
+            self._json_raw = None
+            self._json_data = json_data
+        else:
+            self._json_raw = json_data
+            self._json_data = None
+        self.mime = mime
+        self.parent = parent
+        self._root_prefix = root_prefix
+        self._rel_path = None
+        self._path = None
+
+    @property
+    def json_data(self) -> dict:
+        """
+        :return: Document JSON
+        """
+        if self._json_data is None:
+            self._json_data = _json_loads(self._json_raw)
+        return self._json_data
+
+    @json_data.setter
+    def json_data(self, value: dict):
+        self._json_data = value
+
+    def _serialized_json(self) -> str:
+        # Unparsed documents cannot have been modified, skip the round trip
+        if self._json_data is None:
+            return self._json_raw
+        return _json_dumps(self._json_data)
+
+    @property
+    def rel_path(self) -> str:
+        """
+        :return: Path of the document, relative to the index root
+        """
+        if self._rel_path is None:
+            j = self.json_data
+            # sist2 paths always use forward slashes
+            filename = f"{j['name']}.{j['extension']}" if j["extension"] else j["name"]
+            self._rel_path = f"{j['path']}/{filename}" if j["path"] else filename
+        return self._rel_path
+
+    @property
+    def path(self) -> str:
+        """
+        :return: Absolute path of the document
+        """
+        if self._path is None:
+            self._path = self._root_prefix + self.rel_path
+        return self._path
+
+
+# path -> ((index mtime, WAL mtime), descriptor, versions), shared by all instances of the process
+_index_metadata_cache: Dict[str, Tuple[tuple, Sist2Descriptor, Tuple[Sist2Version, ...]]] = {}
+
+_KV_CACHE_SIZE = 128
+_THUMBNAIL_CACHE_SIZE = 128
+_NOT_FOUND = object()
+
+_SQL_GET_KV = "SELECT value from kv WHERE key=?"
+_SQL_SET_KV = "REPLACE INTO kv (key, value) VALUES (?,?)"
+_SQL_GET_THUMBNAIL = "SELECT data from thumbnail WHERE id=?"
+_SQL_REGISTER_MODEL = "REPLACE INTO model (id, name, url, path, size, type) VALUES (?,?,?,?,?,?)"
+_SQL_UPSERT_EMBEDDING = "REPLACE INTO embedding (id, start, end, model_id, embedding) VALUES (?,?,?,?,?)"
+_SQL_UPDATE_DOCUMENT = "UPDATE document SET mtime=?, size=?, json_data=? WHERE id=?"
+
+# column name -> (SQL expression, numpy dtype)
+_DOCUMENT_COLUMNS = {
+    "id": ("document.id", "U"),
+    "version": ("version", "i8"),
+    "mtime": ("mtime", "i8"),
+    "size": ("size", "i8"),
+    "mime": ("(SELECT name FROM mime WHERE id=document.mime)", object),
+    "parent": ("parent", object),
+    "json_data": ("json_data", None),
+}
+
+
+def _select_columns(columns) -> str:
+    if not columns:
+        raise ValueError("At least one document column is required")
+
+    for col in columns:
+        if col not in _DOCUMENT_COLUMNS:
+            raise ValueError(f"Unknown document column: {col}")
+
+    return ", ".join(_DOCUMENT_COLUMNS[col][0] for col in columns)
+
+
+def _rows_to_docs(rows, root_prefix):
+    return [
+        Sist2Document(row[0], row[1], row[2], row[3], row[4], row[5], row[6], root_prefix)
+        for row in rows
+    ]
+
 
 class Sist2Index:
 
-    def __init__(self, filename: str):
+    def __init__(self, filename: str, readonly: bool = False):
         """
+        The index is switched to WAL mode when no other connection is using it:
+        readers get a consistent snapshot and are not blocked by writers.
+
         :param filename: path to the sist2 index
+        :param readonly: Open a read-only snapshot of the index, faster for analysis scripts.
+            The index must not be modified by another process while it is open.
         """
         self.filename = filename
-        self.conn = sqlite3.connect(filename)
+        self.readonly = readonly
+        if readonly:
+            path = Path(filename).resolve()
+            # immutable=1 ignores the WAL, only use it once all changes have been checkpointed
+            wal = path.with_name(path.name + "-wal")
+            mode = "ro" if wal.exists() and wal.stat().st_size > 0 else "ro&immutable=1"
+            self.conn = sqlite3.connect(f"{path.as_uri()}?mode={mode}", uri=True, cached_statements=256)
+        else:
+            self.conn = sqlite3.connect(filename, cached_statements=256)
 
         self.cur = self.conn.cursor()
-
-        self.last_id = None
-        self._descriptor = self._get_descriptor()
-        self._versions = self._get_versions()
+        # One cursor per hot statement, so that each keeps its prepared statement between calls
+        self._cur_get = self.conn.cursor()
+        self._cur_set = self.conn.cursor()
+        self._cur_thumb = self.conn.cursor()
+        self._cur_upsert_emb = self.conn.cursor()
+        self._cur_update_doc = self.conn.cursor()
+        self._setup_pragmas()
+
+        self._get_cached = lru_cache(maxsize=_KV_CACHE_SIZE)(self._get_uncached)
+        self._thumbnail_cache = OrderedDict()
+
+        self._descriptor, self._versions = self._get_metadata()
+        self._root = self._descriptor.root
+        self._root_prefix = self._root + "/" if self._root and not self._root.endswith("/") else self._root
+        self._versions_by_id = {v.id: v for v in self._versions}
         self._setup_kv()
 
     @property
@@ -68,7 +266,48 @@ class Sist2Index:
         """
         return self._versions
 
+    def get_version(self, id: int) -> Sist2Version | None:
+        """
+        :param id: Version id
+        :return: Version, or None if not found
+        """
+        return self._versions_by_id.get(id)
+
+    def _check_writable(self):
+        if self.readonly:
+            raise sqlite3.OperationalError(f"Index {self.filename} was opened in readonly mode")
+
+    def _setup_pragmas(self):
+        if not self.readonly:
+            self.cur.execute("PRAGMA journal_mode")
+            if self.cur.fetchone()[0] != "wal":
+                self.cur.execute("PRAGMA busy_timeout")
+                busy_timeout = self.cur.fetchone()[0]
+                # Don't wait for the lock, the switch is only an optimization
+                self.cur.execute("PRAGMA busy_timeout=0")
+                try:
+                    self.cur.execute("PRAGMA journal_mode=WAL")
+                except sqlite3.OperationalError:
+                    # Another connection (ex. sist2) is using the index, keep its journal mode
+                    pass
+                finally:
+                    self.cur.execute(f"PRAGMA busy_timeout={busy_timeout}")
+
+            self.cur.execute("PRAGMA journal_mode")
+            if self.cur.fetchone()[0] == "wal":
+                # Only safe in WAL mode: it can corrupt a rollback journal index on power loss
+                self.cur.execute("PRAGMA synchronous=NORMAL")
+        self.cur.execute("PRAGMA temp_store=MEMORY")
+        self.cur.execute("PRAGMA cache_size=-262144")
+        self.cur.execute("PRAGMA mmap_size=1073741824")
+
     def _setup_kv(self):
+        if self.readonly:
+            self.cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='kv'")
+            self._has_kv = self.cur.fetchone() is not None
+            return
+
+        self._has_kv = True
         self.cur.execute(
             "CREATE TABLE IF NOT EXISTS kv ("
             "   key TEXT PRIMARY KEY,"
@@ -80,20 +319,31 @@ class Sist2Index:
         """
         Get value from key-value table. This is used to store configuration or state in user scripts.
 
+        Values are cached, the cache is invalidated by set() and rollback() (but not by conn.rollback()).
+        It will not see changes made by other processes.
+
         :param key: Key
         :param default: Default value to return if not found
         :return: Value or default
         """
 
-        self.cur.execute(
-            "SELECT value from kv WHERE key=?", (key,)
-        )
+        value = self._get_cached(key)
+        if value is _NOT_FOUND:
+            return default
 
-        row = self.cur.fetchone()
+        return value
+
+    def _get_uncached(self, key: str):
+        if not self._has_kv:
+            return _NOT_FOUND
+
+        self._cur_get.execute(_SQL_GET_KV, (key,))
+
+        row = self._cur_get.fetchone()
         if row:
             return row[0]
 
-        return default
+        return _NOT_FOUND
 
     def set(self, key: str, value: str | int) -> None:
         """
@@ -102,13 +352,28 @@ class Sist2Index:
         :param key: Key
         :param value: Value
         """
+        self._check_writable()
 
-        self.cur.execute(
-            "REPLACE INTO kv (key, value) VALUES (?,?)", (key, value)
-        )
+        self._cur_set.execute(_SQL_SET_KV, (key, value))
+        self._get_cached.cache_clear()
 
         return None
 
+    def _get_metadata(self) -> Tuple[Sist2Descriptor, List[Sist2Version]]:
+        # The descriptor and versions only change when sist2 writes to the index
+        path = Path(self.filename).resolve()
+        wal = path.with_name(path.name + "-wal")
+        mtimes = (path.stat().st_mtime_ns, wal.stat().st_mtime_ns if wal.exists() else None)
+
+        cached = _index_metadata_cache.get(str(path))
+        if cached is None or cached[0] != mtimes:
+            # Only the latest snapshot of each index is kept
+            cached = (mtimes, self._get_descriptor(), tuple(self._get_versions()))
+            _index_metadata_cache[str(path)] = cached
+
+        # Each instance gets its own copy of the versions list
+        return cached[1], list(cached[2])
+
     def _get_descriptor(self) -> Sist2Descriptor:
         self.cur.execute(
             "SELECT id, version_major, version_minor, version_patch, root, name, rewrite_url, timestamp FROM descriptor"
@@ -126,22 +391,27 @@ class Sist2Index:
             for row in self.cur.fetchall()
         ]
 
-    def get_thumbnail(self, id: str) -> bytes | None:
+    def get_thumbnail(self, id: str, cache: bool = False) -> bytes | None:
         """
         :param id: Document id
+        :param cache: Keep recently read thumbnails in memory. It will not see changes made by other processes.
         :return: Thumbnail data
         """
-        self.cur.execute(
-            f"SELECT data from thumbnail WHERE id=?",
-            (id,)
-        )
+        if cache and id in self._thumbnail_cache:
+            self._thumbnail_cache.move_to_end(id)
+            return self._thumbnail_cache[id]
 
-        row = self.cur.fetchone()
+        self._cur_thumb.execute(_SQL_GET_THUMBNAIL, (id,))
 
-        if not row:
-            return None
+        row = self._cur_thumb.fetchone()
+        data = row[0] if row else None
 
-        return row[0]
+        if cache:
+            self._thumbnail_cache[id] = data
+            if len(self._thumbnail_cache) > _THUMBNAIL_CACHE_SIZE:
+                self._thumbnail_cache.popitem(last=False)
+
+        return data
 
     def document_count(self, where: str = "") -> int:
         """
@@ -162,51 +432,94 @@ class Sist2Index:
         row = self.cur.fetchone()
         return row[0]
 
-    def document_iter(self, where: str = ""):
+    def document_iter(self, where: str = "", columns=None):
         """
         Iterate documents
 
         :param where: SQL WHERE clause (ex. 'size > 100')
+        :param columns: (optional) Only fetch these columns (id, version, mtime, size, mime, parent, json_data)
+            and yield plain tuples instead of Sist2Document. Much faster when json_data is not needed.
         :return: generator
         """
-        self.last_id = None
-
-        doc = self._get_next_doc(where)
-        while doc:
-            yield doc
-            doc = self._get_next_doc(where)
+        if where:
+            where = f"WHERE {where}"
 
-    def _get_next_doc(self, where=""):
-        if self.last_id is None:
-            where = f"WHERE {where}" if where else ""
-            args = []
-        elif where:
-            where = f"WHERE document.id > ? AND ({where})"
-            args = (self.last_id,)
+        if columns is None:
+            select = "document.id, version, mtime, size, json_data, (SELECT name FROM mime WHERE id=document.mime), parent"
         else:
-            where = f"WHERE document.id > ?"
-            args = (self.last_id,)
+            columns = tuple(columns)
+            select = _select_columns(columns)
 
-        self.cur.execute(
-            f"SELECT document.id, version, mtime, size, json_data, (SELECT name FROM mime WHERE id=document.mime), parent "
+        # Dedicated cursor: the caller is free to use the index while iterating
+        cur = self.conn.cursor()
+        cur.execute(
+            f"SELECT {select} "
             f"FROM document"
             f" {where}"
-            f" ORDER BY document.id LIMIT 1",
-            args
+            f" ORDER BY document.id"
         )
 
-        row = self.cur.fetchone()
-        if not row:
-            return None
+        try:
+            if columns is None:
+                while rows := cur.fetchmany(1000):
+                    yield from _rows_to_docs(rows, self._root_prefix)
+            elif "json_data" in columns:
+                json_idx = columns.index("json_data")
+                while rows := cur.fetchmany(1000):
+                    for row in rows:
+                        yield *row[:json_idx], _json_loads(row[json_idx]), *row[json_idx + 1:]
+            else:
+                while rows := cur.fetchmany(1000):
+                    yield from rows
+        finally:
+            cur.close()
+
+    def document_columns(self, columns=("id", "mtime", "size"), where: str = "") -> dict:
+        """
+        Fetch document columns in bulk, for fast analysis with numpy (requires numpy).
+        Scalar columns are returned as numpy arrays, json_data is returned as a list of dicts.
+
+        ex::
 
-        j = json.loads(row[4])
-        rel_path = os.path.join(j["path"], j["name"] + ("." + j["extension"] if j["extension"] else ""))
-        path = os.path.join(self.descriptor.root, j["path"],
-                            j["name"] + ("." + j["extension"] if j["extension"] else ""))
+            cols = index.document_columns(("id", "size"))
+            large_ids = cols["id"][cols["size"] > 1_000_000]
+
+        :param columns: Columns to fetch (id, version, mtime, size, mime, parent, json_data)
+        :param where: SQL WHERE clause (ex. 'size > 100')
+        :return: dict of column name -> values, in document id order
+        """
+        if np is None:
+            raise ImportError("numpy is required for document_columns()")
+
+        select = _select_columns(columns)
+
+        if where:
+            where = f"WHERE {where}"
 
-        self.last_id = row[0]
+        cur = self.conn.cursor()
+        cur.arraysize = 10000
+        cur.execute(
+            f"SELECT {select} "
+            f"FROM document"
+            f" {where}"
+            f" ORDER BY document.id"
+        )
 
-        return Sist2Document(row[0], row[1], row[2], row[3], j, rel_path, path, row[5], row[6])
+        values = [[] for _ in columns]
+        try:
+            while rows := cur.fetchmany():
+                for i, col_values in enumerate(zip(*rows)):
+                    values[i].extend(col_values)
+        finally:
+            cur.close()
+
+        result = {}
+        for col, col_values in zip(columns, values):
+            if col == "json_data":
+                result[col] = [_json_loads(v) for v in col_values]
+            else:
+                result[col] = np.array(col_values, dtype=_DOCUMENT_COLUMNS[col][1])
+        return result
 
     def register_model(self, id: int, name: str, url: str, path: str, size: int, type: str) -> None:
         """
@@ -219,10 +532,8 @@ class Sist2Index:
         :param size: Size of the embedding in dimensions.
         :param type: Must be either 'flat' (one embedding per document) or 'nested' (multiple embeddings per document).
         """
-        self.cur.execute(
-            "REPLACE INTO model (id, name, url, path, size, type) VALUES (?,?,?,?,?,?)",
-            (id, name, url, path, size, type)
-        )
+        self._check_writable()
+        self.cur.execute(_SQL_REGISTER_MODEL, (id, name, url, path, size, type))
 
     def upsert_embedding(self, id: str, start: int, end: int | None, model_id: int, embedding: bytes) -> None:
         """
@@ -234,11 +545,43 @@ class Sist2Index:
         :param model_id: Model ID
         :param embedding: Encoded float32 embeddings (use serialize_float_array() to convert)
         """
-        self.cur.execute(
-            """
-            REPLACE INTO embedding (id, start, end, model_id, embedding) VALUES (?,?,?,?,?)
-            """,
-            (id, start, end, model_id, embedding)
+        self._check_writable()
+        self._cur_upsert_emb.execute(_SQL_UPSERT_EMBEDDING, (id, start, end, model_id, embedding))
+
+    def upsert_embeddings_many(self, rows) -> None:
+        """
+        Upsert many embeddings at once. Faster than calling upsert_embedding() in a loop
+
+        :param rows: Iterable of (id, start, end, model_id, embedding) tuples, see upsert_embedding().
+            embedding can also be a float array (numpy etc.), it is encoded with serialize_float_array()
+        """
+        self._check_writable()
+        rows = (
+            row if isinstance(row[4], (bytes, bytearray, memoryview)) else (*row[:4], serialize_float_array(row[4]))
+            for row in rows
+        )
+
+        with self.transaction():
+            self._cur_upsert_emb.executemany(_SQL_UPSERT_EMBEDDING, rows)
+
+    def upsert_embeddings_matrix(self, ids: List[str], embeddings, model_id: int, start: int = 0,
+                                 end: int | None = None) -> None:
+        """
+        Upsert one embedding per document from a 2D array
+
+        :param ids: Document IDs, one per row of embeddings
+        :param embeddings: 2D float32 array of shape (len(ids), dim) (numpy etc.)
+        :param model_id: Model ID
+        :param start: Start offset in .content
+        :param end: (optional) End offset in .content
+        """
+        blobs = serialize_float_matrix(embeddings)
+        if len(blobs) != len(ids):
+            raise ValueError(f"Got {len(ids)} ids for {len(blobs)} embeddings")
+
+        self.upsert_embeddings_many(
+            (id, start, end, model_id, blob)
+            for id, blob in zip(ids, blobs)
         )
 
     def update_document(self, doc: Sist2Document) -> None:
@@ -247,13 +590,21 @@ class Sist2Index:
 
         :param doc: document
         """
-        self.cur.execute(
-            """
-            UPDATE document SET mtime=?, size=?, json_data=?
-            WHERE id=?
-            """,
-            (doc.mtime, doc.size, json.dumps(doc.json_data), doc.id)
-        )
+        self._check_writable()
+        self._cur_update_doc.execute(_SQL_UPDATE_DOCUMENT, (doc.mtime, doc.size, doc._serialized_json(), doc.id))
+
+    def update_documents_many(self, docs) -> None:
+        """
+        Update many documents at once. Faster than calling update_document() in a loop
+
+        :param docs: Iterable of documents
+        """
+        self._check_writable()
+        with self.transaction():
+            self._cur_update_doc.executemany(
+                _SQL_UPDATE_DOCUMENT,
+                ((doc.mtime, doc.size, doc._serialized_json(), doc.id) for doc in docs)
+            )
 
     def sync_tag_table(self) -> None:
         """
@@ -261,10 +612,40 @@ class Sist2Index:
         You must call this function for tag filtering to function when using the SQLite search backend.
         This has no effect when using a ElasticSearch backend
         """
-        self.cur.execute("DELETE FROM tag")
-        self.cur.execute(
-            "REPLACE INTO tag SELECT document.id, json_each.value "
-            "FROM document, json_each(json_extract(document.json_data, '$.tag'))")
+        self._check_writable()
+
+        with self.transaction():
+            self.cur.execute("DELETE FROM tag")
+            # The table is empty: conflicts can only come from duplicate tags within a document.
+            # Insert in key order so that the B-tree pages are written sequentially.
+            # Secondary indexes are kept: they can't be dropped while a document_iter() is still running.
+            self.cur.execute(
+                "INSERT OR IGNORE INTO tag SELECT document.id, json_each.value "
+                "FROM document, json_each(json_extract(document.json_data, '$.tag')) ORDER BY 1, 2")
+
+    @contextmanager
+    def transaction(self):
+        """
+        Group writes in a single transaction, committed on exit and rolled back on error.
+        If a transaction is already open, the writes are simply added to it and nothing is committed.
+
+        ex::
+
+            with index.transaction():
+                for doc in docs:
+                    index.upsert_embedding(doc.id, 0, None, 1, serialize_float_array(...))
+        """
+        if self.conn.in_transaction:
+            yield
+            return
+
+        self.cur.execute("BEGIN")
+        try:
+            yield
+            self.conn.commit()
+        except BaseException:
+            self.rollback()
+            raise
 
     def commit(self) -> None:
         """
@@ -272,16 +653,48 @@ class Sist2Index:
         """
         self.conn.commit()
 
+    def rollback(self) -> None:
+        """
+        Roll back uncommitted changes. Use this instead of conn.rollback(), which does not invalidate the cache of get()
+        """
+        self.conn.rollback()
+        self._get_cached.cache_clear()
+        self._thumbnail_cache.clear()
+
 
 def serialize_float_array(array) -> bytes:
     """
     :param array: float32 array (numpy etc.)
     :return: Encoded bytes, suitable for the embeddings table in sist2
     """
-    return b''.join(
-        struct.pack("f", x)
-        for x in array
-    )
+    if np is None:
+        return _array.array("f", array).tobytes()
+
+    arr = np.asarray(array, dtype=np.float32)
+    if not arr.flags.c_contiguous:
+        arr = np.ascontiguousarray(arr)
+    return arr.tobytes()
+
+
+def serialize_float_matrix(matrix) -> List[bytes]:
+    """
+    :param matrix: 2D float32 array of shape (n, dim), one embedding per row (numpy etc.)
+    :return: List of encoded bytes, one per row, suitable for the embeddings table in sist2
+    """
+    if np is None:
+        return [serialize_float_array(row) for row in matrix]
+
+    mat = np.ascontiguousarray(matrix, dtype=np.float32)
+    if mat.ndim != 2:
+        raise ValueError(f"Expected a 2D array, got shape {mat.shape}")
+
+    # Slice the raw buffer directly rather than creating one ndarray per row
+    buf = memoryview(mat).cast("B")
+    row_size = mat.shape[1] * mat.itemsize
+    return [
+        buf[i * row_size:(i + 1) * row_size].tobytes()
+        for i in range(mat.shape[0])
+    ]
 
 
 def print_progress(done: int = 0, count: int = 0) -> None:
@@ -298,4 +711,12 @@ def print_progress(done: int = 0, count: int = 0) -> None:
         "waiting": True
     }
 
-    print(f"$PROGRESS {json.dumps(progress)}")
+    buffer = getattr(sys.stdout, "buffer", None)
+    if buffer is None:
+        print(f"$PROGRESS {_json_dumps(progress)}", flush=True)
+        return
+
+    # Keep ordering with text already printed, flush right away so that sist2-admin sees it
+    sys.stdout.flush()
+    buffer.write(b"$PROGRESS " + _json_dumps_bytes(progress) + b"\n")
+    buffer.flush()
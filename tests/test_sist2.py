@@ -0,0 +1,342 @@
+import json
+import math
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+import sist2
+from sist2 import Sist2Index, serialize_float_array, serialize_float_matrix
+
+
+@pytest.fixture
+def index_file(tmp_path):
+    filename = str(tmp_path / "index.sist2")
+
+    conn = sqlite3.connect(filename)
+    conn.executescript(
+        "CREATE TABLE descriptor (id TEXT, version_major INT, version_minor INT, version_patch INT,"
+        "   root TEXT, name TEXT, rewrite_url TEXT, timestamp INT);"
+        "CREATE TABLE version (id INTEGER PRIMARY KEY, date INT);"
+        "CREATE TABLE mime (id INTEGER PRIMARY KEY, name TEXT);"
+        "CREATE TABLE document (id TEXT PRIMARY KEY, version INT, mtime INT, size INT, mime INT,"
+        "   parent TEXT, json_data TEXT);"
+        "CREATE TABLE tag (id TEXT NOT NULL, tag TEXT NOT NULL, PRIMARY KEY (id, tag));"
+        "CREATE INDEX tag_tag_index ON tag (tag);"
+        "CREATE TABLE embedding (id TEXT, start INT, end INT, model_id INT, embedding BLOB,"
+        "   PRIMARY KEY (id, start, model_id));"
+        "INSERT INTO descriptor VALUES ('idx', 3, 0, 0, '/files/', 'test', '', 0);"
+        "INSERT INTO version VALUES (1, 0);"
+        "INSERT INTO mime VALUES (1, 'text/plain');"
+    )
+    _insert_documents(conn, 3)
+    conn.commit()
+    conn.close()
+
+    return filename
+
+
+def _insert_documents(conn, count, start=0):
+    for i in range(start, start + count):
+        json_data = {"path": "dir", "name": f"f{i}", "extension": "txt", "tag": [f"tag{i}.#000000"]}
+        conn.execute(
+            "INSERT INTO document VALUES (?,?,?,?,?,?,?)",
+            (f"doc{i}", 1, 0, 10, 1, None, json.dumps(json_data))
+        )
+
+
+def test_sync_tag_table(index_file):
+    index = Sist2Index(index_file)
+    index.sync_tag_table()
+    index.commit()
+
+    index.cur.execute("SELECT id, tag FROM tag ORDER BY id")
+    assert index.cur.fetchall() == [("doc0", "tag0.#000000"), ("doc1", "tag1.#000000"), ("doc2", "tag2.#000000")]
+
+    index.cur.execute("SELECT name FROM sqlite_master WHERE type='index' AND name='tag_tag_index'")
+    assert index.cur.fetchone() is not None
+
+
+def test_sync_tag_table_during_document_iter(index_file):
+    conn = sqlite3.connect(index_file)
+    _insert_documents(conn, 1500, start=3)
+    conn.commit()
+    conn.close()
+
+    index = Sist2Index(index_file)
+    it = index.document_iter()
+    next(it)
+
+    index.sync_tag_table()
+    index.commit()
+
+    assert sum(1 for _ in it) == 1502
+    index.cur.execute("SELECT COUNT(*) FROM tag")
+    assert index.cur.fetchone()[0] == 1503
+
+
+def test_sync_tag_table_rollback(index_file):
+    index = Sist2Index(index_file)
+
+    with pytest.raises(RuntimeError):
+        with index.transaction():
+            index.set("k", "inside")
+            index.sync_tag_table()
+            raise RuntimeError()
+
+    index.cur.execute("SELECT COUNT(*) FROM tag")
+    assert index.cur.fetchone()[0] == 0
+
+    index.cur.execute("SELECT value FROM kv WHERE key='k'")
+    assert index.cur.fetchone() is None
+
+
+def test_update_document_json_types(index_file):
+    index = Sist2Index(index_file)
+
+    doc = next(index.document_iter("id='doc0'"))
+    doc.json_data["scores"] = {1: "x"}
+    doc.json_data["big"] = 2 ** 70
+    index.update_document(doc)
+    index.commit()
+
+    doc = next(index.document_iter("id='doc0'"))
+    assert doc.json_data["scores"] == {"1": "x"}
+    assert doc.json_data["big"] == 2 ** 70
+
+
+def test_upsert_embeddings_many(index_file):
+    index = Sist2Index(index_file)
+
+    blob = serialize_float_array([1.0, 2.0])
+    index.upsert_embeddings_many([
+        ("doc0", 0, None, 1, blob),
+        ("doc1", 0, None, 1, bytearray(blob)),
+        ("doc2", 0, None, 1, memoryview(blob)),
+        ("doc3", 0, None, 1, [1.0, 2.0]),
+    ])
+
+    index.cur.execute("SELECT embedding FROM embedding")
+    assert [row[0] for row in index.cur.fetchall()] == [blob] * 4
+
+
+def test_open_wal(index_file):
+    index = Sist2Index(index_file)
+
+    index.cur.execute("PRAGMA journal_mode")
+    assert index.cur.fetchone()[0] == "wal"
+    index.cur.execute("PRAGMA synchronous")
+    assert index.cur.fetchone()[0] == 1
+
+
+def test_open_while_index_is_read(index_file):
+    Sist2Index(index_file).conn.close()
+
+    # Switch back to the default journal mode, as left by sist2
+    conn = sqlite3.connect(index_file)
+    conn.execute("PRAGMA journal_mode=DELETE")
+    conn.close()
+
+    reader = sqlite3.connect(index_file)
+    reader.execute("BEGIN")
+    reader.execute("SELECT COUNT(*) FROM document").fetchone()
+
+    index = Sist2Index(index_file)
+    assert index.document_count() == 3
+
+    # The WAL switch was skipped, synchronous must stay at FULL (2)
+    index.cur.execute("PRAGMA journal_mode")
+    assert index.cur.fetchone()[0] == "delete"
+    index.cur.execute("PRAGMA synchronous")
+    assert index.cur.fetchone()[0] == 2
+
+    reader.rollback()
+
+
+def test_document_iter_row_factory(index_file):
+    index = Sist2Index(index_file)
+    index.conn.row_factory = sqlite3.Row
+
+    assert [doc.path for doc in index.document_iter()] == ["/files/dir/f0.txt", "/files/dir/f1.txt", "/files/dir/f2.txt"]
+
+
+def test_document_iter_columns(index_file):
+    index = Sist2Index(index_file)
+
+    assert list(index.document_iter("id='doc1'", columns=("id", "size"))) == [("doc1", 10)]
+
+    with pytest.raises(ValueError):
+        list(index.document_iter(columns=()))
+    with pytest.raises(ValueError):
+        list(index.document_iter(columns=("id; DROP TABLE document",)))
+
+
+def test_document_path_empty_root(index_file):
+    conn = sqlite3.connect(index_file)
+    conn.execute("UPDATE descriptor SET root=''")
+    conn.commit()
+    conn.close()
+
+    index = Sist2Index(index_file)
+    doc = next(index.document_iter("id='doc0'"))
+    assert doc.rel_path == "dir/f0.txt"
+    assert doc.path == "dir/f0.txt"
+
+
+def test_metadata_cache(index_file):
+    index1 = Sist2Index(index_file)
+    index1.versions.append(None)
+    cache_size = len(sist2._index_metadata_cache)
+
+    index1.set("k", "v")
+    index1.commit()
+
+    index2 = Sist2Index(index_file)
+    assert index2.versions == [(1, 0)]
+    assert index2.get_version(1).date == 0
+
+    # The entry of the index is replaced when it changes
+    assert len(sist2._index_metadata_cache) == cache_size
+
+
+def test_get_cache_rollback(index_file):
+    index = Sist2Index(index_file)
+
+    index.set("k", "v")
+    assert index.get("k") == "v"
+    index.rollback()
+    assert index.get("k") is None
+
+
+def test_transaction_commit_error(index_file):
+    index = Sist2Index(index_file)
+    index.cur.execute("PRAGMA foreign_keys=ON")
+    index.cur.execute(
+        "CREATE TABLE child (doc_id TEXT REFERENCES document(id) DEFERRABLE INITIALLY DEFERRED)"
+    )
+    index.commit()
+
+    with pytest.raises(sqlite3.IntegrityError):
+        with index.transaction():
+            index.set("k", "v")
+            index.cur.execute("INSERT INTO child VALUES ('missing')")
+
+    assert not index.conn.in_transaction
+    assert index.get("k") is None
+
+
+def test_update_document_non_finite_floats(index_file):
+    index = Sist2Index(index_file)
+
+    doc = next(index.document_iter("id='doc0'"))
+    doc.json_data["nan"] = float("nan")
+    doc.json_data["inf"] = float("inf")
+    index.update_document(doc)
+    index.commit()
+
+    doc = next(index.document_iter("id='doc0'"))
+    assert math.isnan(doc.json_data["nan"])
+    assert doc.json_data["inf"] == float("inf")
+
+
+@pytest.mark.parametrize("empty_wal", [False, True])
+def test_readonly_immutable(index_file, empty_wal):
+    if empty_wal:
+        Path(index_file + "-wal").touch()
+
+    # immutable=1 does not take locks, an exclusive lock held by a writer doesn't block it
+    writer = sqlite3.connect(index_file)
+    writer.execute("BEGIN EXCLUSIVE")
+
+    index = Sist2Index(index_file, readonly=True)
+    assert index.document_count() == 3
+
+    writer.rollback()
+
+
+def test_readonly_uncheckpointed_wal(index_file):
+    writer = Sist2Index(index_file)
+    writer.set("k", "v")
+    writer.commit()
+    assert Path(index_file + "-wal").stat().st_size > 0
+
+    # The committed change is only in the WAL, it must not be hidden
+    index = Sist2Index(index_file, readonly=True)
+    assert index.get("k") == "v"
+
+
+def test_readonly_writes(index_file):
+    index = Sist2Index(index_file, readonly=True)
+    doc = next(index.document_iter())
+
+    with pytest.raises(sqlite3.OperationalError):
+        index.set("k", "v")
+    with pytest.raises(sqlite3.OperationalError):
+        index.update_document(doc)
+    with pytest.raises(sqlite3.OperationalError):
+        index.upsert_embedding(doc.id, 0, None, 1, serialize_float_array([1.0]))
+    with pytest.raises(sqlite3.OperationalError):
+        index.sync_tag_table()
+
+
+def test_readonly_without_kv_table(index_file):
+    index = Sist2Index(index_file, readonly=True)
+
+    index.cur.execute("SELECT 1 FROM sqlite_master WHERE name='kv'")
+    assert index.cur.fetchone() is None
+    assert index.get("k", "default") == "default"
+
+
+def test_document_columns(index_file):
+    np = pytest.importorskip("numpy")
+    index = Sist2Index(index_file)
+
+    cols = index.document_columns(("id", "version", "mtime", "size", "mime", "parent", "json_data"))
+    assert cols["id"].dtype.kind == "U"
+    assert list(cols["id"]) == ["doc0", "doc1", "doc2"]
+    for col in ("version", "mtime", "size"):
+        assert cols[col].dtype == np.int64
+    assert list(cols["size"]) == [10, 10, 10]
+    assert cols["mime"].dtype == object
+    assert list(cols["mime"]) == ["text/plain"] * 3
+    assert list(cols["parent"]) == [None] * 3
+    assert cols["json_data"][1]["name"] == "f1"
+
+
+def test_document_columns_empty(index_file):
+    np = pytest.importorskip("numpy")
+    index = Sist2Index(index_file)
+
+    cols = index.document_columns(where="size > 100")
+    assert set(cols) == {"id", "mtime", "size"}
+    assert all(len(values) == 0 for values in cols.values())
+    assert cols["size"].dtype == np.int64
+
+
+def test_serialize_float_matrix():
+    np = pytest.importorskip("numpy")
+    matrix = np.arange(6, dtype=np.float64).reshape(3, 2)
+
+    assert serialize_float_matrix(matrix) == [serialize_float_array(row) for row in matrix]
+    # Non-contiguous input
+    assert serialize_float_matrix(matrix.T) == [serialize_float_array(row) for row in matrix.T]
+
+    with pytest.raises(ValueError):
+        serialize_float_matrix(np.zeros(3))
+
+
+def test_upsert_embeddings_matrix(index_file):
+    np = pytest.importorskip("numpy")
+    index = Sist2Index(index_file)
+    matrix = np.arange(6, dtype=np.float32).reshape(3, 2)
+
+    index.upsert_embeddings_matrix(["doc0", "doc1", "doc2"], matrix, 1)
+
+    index.cur.execute("SELECT id, start, end, model_id, embedding FROM embedding ORDER BY id")
+    assert index.cur.fetchall() == [
+        (f"doc{i}", 0, None, 1, serialize_float_array(matrix[i]))
+        for i in range(3)
+    ]
+
+    with pytest.raises(ValueError):
+        index.upsert_embeddings_matrix(["doc0", "doc1"], matrix, 1)